@@ -1,4 +1,7 @@
+import json
 import os
+import time
+from pathlib import Path
 from dotenv import load_dotenv
 import google.generativeai as genai
 
@@ -12,16 +15,30 @@ if not api_key:
 
 print(f"🔑 Checking EMBEDDING models for API Key: {api_key[:5]}...")
 
-genai.configure(api_key=api_key)
+# Cache the model list locally so repeated runs skip the API round-trip
+CACHE_FILE = Path.home() / ".cache" / "gemini_models.json"
+CACHE_TTL_S = 86400
+
+def get_embedding_models() -> list[str]:
+    if CACHE_FILE.exists() and time.time() - CACHE_FILE.stat().st_mtime < CACHE_TTL_S:
+        return json.loads(CACHE_FILE.read_text())
+
+    genai.configure(api_key=api_key)
+    models = [
+        m.name for m in genai.list_models()
+        if 'embedContent' in m.supported_generation_methods
+    ]
+
+    CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    CACHE_FILE.write_text(json.dumps(models))
+    return models
 
 try:
     print("\n✅ AVAILABLE EMBEDDING MODELS (Copy one of these exactly):")
     print("-" * 50)
-    for m in genai.list_models():
-        # This time we look for 'embedContent' capability
-        if 'embedContent' in m.supported_generation_methods:
-            print(f"👉 {m.name}")
+    for name in get_embedding_models():
+        print(f"👉 {name}")
     print("-" * 50)
 
 except Exception as e:
-    print(f"\n❌ Error listing models: {e}")
\ No newline at end of file
+    print(f"\n❌ Error listing models: {e}")
@@ -10,6 +10,10 @@ class RAGUpsertResult(pydantic.BaseModel):
 class RAGSearchResult(pydantic.BaseModel):
     contexts: list[str]
     sources: list[str]
+    # Set when the semantic cache already holds an answer for this query,
+    # letting the caller skip generation entirely.
+    cached_answer: str | None = None
+    cached_num_contexts: int = 0
 
 
 class RAGQueryResult(pydantic.BaseModel):
@@ -1,10 +1,19 @@
+import asyncio
+import hashlib
 import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+from pypdf import PdfReader
+
+import numpy as np
 from dotenv import load_dotenv
 from llama_index.core import Settings
 
 from llama_index.llms.gemini import Gemini
 from llama_index.embeddings.gemini import GeminiEmbedding
-from llama_index.readers.file import PDFReader
 from llama_index.core.node_parser import SentenceSplitter
 
 load_dotenv()
@@ -30,14 +39,125 @@ EMBED_DIM = 768
 splitter = SentenceSplitter(chunk_size=1000, chunk_overlap=200)
 
 # --- LOAD PDF ---
+# Below this page count the process-pool spawn cost outweighs the parse win
+_PARALLEL_PAGE_THRESHOLD = 8
+
+def _extract_page(args: tuple[str, int]) -> str:
+    # Top-level so it can be pickled into worker processes
+    path, page_idx = args
+    return PdfReader(path).pages[page_idx].extract_text() or ""
+
 def load_chunk_pdf(path: str):
-    docs = PDFReader().load_data(file=path)
-    texts = [d.text for d in docs if getattr(d, "text", None)]
+    # Read the whole file up front: the PDF parser does many small seeks/reads,
+    # which are far cheaper against an in-memory buffer than the filesystem.
+    data = Path(path).read_bytes()
+    reader = PdfReader(BytesIO(data))
+    n_pages = len(reader.pages)
+
+    if n_pages < _PARALLEL_PAGE_THRESHOLD:
+        texts = [page.extract_text() or "" for page in reader.pages]
+    else:
+        # Page extraction is CPU-bound in pypdf; a process pool scales it
+        # with cores instead of serializing behind the GIL.
+        with ProcessPoolExecutor() as ex:
+            texts = list(ex.map(_extract_page, [(path, i) for i in range(n_pages)], chunksize=4))
+
     chunks = []
     for t in texts:
-        chunks.extend(splitter.split_text(t))
+        if t:
+            chunks.extend(splitter.split_text(t))
     return chunks
 
+# --- EMBEDDING CACHE ---
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "embed_cache.db")
+
+def _cache_conn() -> sqlite3.Connection:
+    conn = sqlite3.connect(EMBED_CACHE_PATH)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS embed_cache ("
+        "hash TEXT NOT NULL, model TEXT NOT NULL, vector BLOB NOT NULL, "
+        "PRIMARY KEY (hash, model))"
+    )
+    return conn
+
+def _text_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+def _cache_get_many(conn: sqlite3.Connection, hashes: list[str]) -> dict[str, list[float]]:
+    if not hashes:
+        return {}
+    placeholders = ",".join("?" * len(hashes))
+    rows = conn.execute(
+        f"SELECT hash, vector FROM embed_cache WHERE hash IN ({placeholders}) AND model=?",
+        [*hashes, EMBED_MODEL],
+    )
+    return {h: _blob_to_vec(blob) for h, blob in rows}
+
+def _blob_to_vec(blob: bytes) -> np.ndarray:
+    # New entries are float16; older caches may still hold float32 blobs.
+    dtype = np.float32 if len(blob) == EMBED_DIM * 4 else np.float16
+    return np.frombuffer(blob, dtype=dtype).astype(np.float32)
+
+def _cache_put_many(conn: sqlite3.Connection, items: dict) -> None:
+    conn.executemany(
+        "INSERT OR REPLACE INTO embed_cache (hash, model, vector) VALUES (?, ?, ?)",
+        [(h, EMBED_MODEL, np.asarray(vec, dtype=np.float16).tobytes()) for h, vec in items.items()],
+    )
+    conn.commit()
+
 # --- EMBED TEXTS ---
-def embed_texts(texts: list[str]) -> list[list[float]]:
-    return Settings.embed_model.get_text_embedding_batch(texts)
\ No newline at end of file
+EMBED_BATCH_SIZE = 100
+EMBED_MAX_IN_FLIGHT = 16
+
+# Module-level so the in-flight bound holds across concurrent aembed_texts
+# calls, not just within one
+_embed_semaphore = asyncio.Semaphore(EMBED_MAX_IN_FLIGHT)
+
+def embed_texts(texts: list[str]) -> np.ndarray:
+    """Uncached sync embedding; the ingest/query paths use aembed_texts."""
+    # Packed float32 (N, dim) array: ~7x smaller than N lists of boxed floats
+    return np.asarray(Settings.embed_model.get_text_embedding_batch(texts), dtype=np.float32)
+
+async def aembed_texts(texts: list[str]) -> np.ndarray:
+    """Embed texts concurrently, serving unchanged chunks from the cache."""
+    if not texts:
+        return np.empty((0, EMBED_DIM), dtype=np.float32)
+    conn = _cache_conn()
+    try:
+        hashes = [_text_hash(t) for t in texts]
+        hits = _cache_get_many(conn, list(set(hashes)))
+
+        miss_idx = [i for i, h in enumerate(hashes) if h not in hits]
+        if miss_idx:
+            miss_vecs = await _aembed_uncached([texts[i] for i in miss_idx])
+            new_items = {hashes[i]: vec for i, vec in zip(miss_idx, miss_vecs)}
+            _cache_put_many(conn, new_items)
+            hits.update(new_items)
+
+        return np.stack([hits[h] for h in hashes])
+    finally:
+        conn.close()
+
+async def _aembed_uncached(texts: list[str]) -> np.ndarray:
+    """Embed texts concurrently in micro-batches, preserving input order."""
+    if not texts:
+        return np.empty((0, EMBED_DIM), dtype=np.float32)
+
+    # Sort longest-first so batches are evenly sized and one ragged
+    # batch doesn't dominate tail latency.
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+    batches = [order[i:i + EMBED_BATCH_SIZE] for i in range(0, len(order), EMBED_BATCH_SIZE)]
+
+    async def _embed_batch(indices: list[int]) -> list[list[float]]:
+        async with _embed_semaphore:
+            return await Settings.embed_model.aget_text_embedding_batch([texts[i] for i in indices])
+
+    batch_results = await asyncio.gather(*(_embed_batch(b) for b in batches))
+
+    # Scatter results back into original order, packed as float32
+    vecs = np.empty((len(texts), EMBED_DIM), dtype=np.float32)
+    for indices, batch_vecs in zip(batches, batch_results):
+        for i, vec in zip(indices, batch_vecs):
+            vecs[i] = vec
+    return vecs
\ No newline at end of file
@@ -1,4 +1,8 @@
+import asyncio
+import hashlib
 import logging
+import time
+from collections import OrderedDict
 from fastapi import FastAPI
 import inngest
 import inngest.fast_api
@@ -6,13 +10,23 @@ from dotenv import load_dotenv
 import uuid
 import os
 
+import numpy as np
+
+# Faster event loop for the async-heavy embed/Qdrant/LLM paths.
+# uvloop is optional (not available on Windows).
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
 # LlamaIndex Settings
 from llama_index.core import Settings
 
 
-from data_loader import embed_texts 
+from data_loader import aembed_texts, splitter
 from vector_db import QdrantStorage
-from custom_types import RAGUpsertResult, RAGSearchResult
+from custom_types import RAGUpsertResult, RAGSearchResult, RAGQueryResult
 
 load_dotenv()
 
@@ -34,6 +48,117 @@ inngest_client = inngest.Inngest(
     serializer=inngest.PydanticSerializer()
 )
 
+# Shared Qdrant client: connection setup (TLS handshake, pool warmup) is paid
+# once at startup instead of on every event.
+_qdrant = QdrantStorage()
+
+# --- SEMANTIC QUERY CACHE ---
+class SemanticQueryCache:
+    """In-memory cache of answered queries, matched by embedding similarity."""
+
+    def __init__(self, threshold: float = 0.95, ttl_s: float = 24 * 3600):
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        # Unit-norm query vectors kept as one contiguous matrix so lookup is
+        # a single BLAS matvec instead of a Python loop of dot products.
+        self._vecs: np.ndarray | None = None
+        self._results: list[RAGQueryResult] = []
+        self._times: list[float] = []
+
+    @staticmethod
+    def _normalize(vec) -> np.ndarray:
+        v = np.asarray(vec, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def _prune(self) -> None:
+        now = time.time()
+        keep = [i for i, t in enumerate(self._times) if now - t < self.ttl_s]
+        if len(keep) == len(self._times):
+            return
+        self._results = [self._results[i] for i in keep]
+        self._times = [self._times[i] for i in keep]
+        self._vecs = self._vecs[keep] if keep else None
+
+    def get(self, query_vec) -> RAGQueryResult | None:
+        self._prune()
+        if self._vecs is None:
+            return None
+        scores = self._vecs @ self._normalize(query_vec)
+        idx = int(scores.argmax())
+        if scores[idx] > self.threshold:
+            return self._results[idx]
+        return None
+
+    def put(self, query_vec, result: RAGQueryResult) -> None:
+        row = self._normalize(query_vec)[None, :]
+        self._vecs = row if self._vecs is None else np.vstack([self._vecs, row])
+        self._results.append(result)
+        self._times.append(time.time())
+
+query_cache = SemanticQueryCache()
+
+# Exact-match layer: identical repeated questions skip even the query
+# embedding. Bounded LRU keyed by normalized question text.
+EXACT_CACHE_MAX = 1024
+_exact_cache: OrderedDict[str, RAGQueryResult] = OrderedDict()
+
+# Query vectors held between the search step and the cache write after
+# generation, so they never go through Inngest step state as JSON.
+# Capped like _exact_cache: runs cancelled between steps never come back
+# to pop their entry, so the oldest get evicted instead of piling up.
+PENDING_VECS_MAX = 1024
+_pending_query_vecs: OrderedDict[str, list[float]] = OrderedDict()
+
+def _park_query_vec(key: str, vec: list[float]) -> None:
+    _pending_query_vecs[key] = vec
+    _pending_query_vecs.move_to_end(key)
+    while len(_pending_query_vecs) > PENDING_VECS_MAX:
+        _pending_query_vecs.popitem(last=False)
+
+def _exact_cache_key(question: str) -> str:
+    return hashlib.md5(question.strip().lower().encode()).hexdigest()
+
+def _exact_cache_put(key: str, result: RAGQueryResult) -> None:
+    _exact_cache[key] = result
+    _exact_cache.move_to_end(key)
+    while len(_exact_cache) > EXACT_CACHE_MAX:
+        _exact_cache.popitem(last=False)
+
+
+# --- ANSWER DELIVERY (long-poll) ---
+# Completed query outputs by event id, with an asyncio.Event per id so the
+# /answer endpoint can long-poll instead of clients polling the run API.
+#
+# In-process only: with multiple workers or replicas the long-poll must hit
+# the process that ran the query (move this to Redis to lift that); other
+# processes return "pending" and the client falls back to run-API polling.
+# Answers are delivered once and evicted; the store is capped as backstop
+# for outputs nobody ever collects.
+ANSWER_CACHE_MAX = 1024
+_answer_events: dict[str, asyncio.Event] = {}
+_answers: OrderedDict[str, dict] = OrderedDict()
+
+def _publish_answer(event_id: str | None, output: dict) -> None:
+    if not event_id:
+        return
+    _answers[event_id] = output
+    _answers.move_to_end(event_id)
+    _answer_events.setdefault(event_id, asyncio.Event()).set()
+    while len(_answers) > ANSWER_CACHE_MAX:
+        oldest, _ = _answers.popitem(last=False)
+        _answer_events.pop(oldest, None)
+
+
+# uuid5 without uuid-module overhead: hash the precomputed namespace bytes
+# directly and set the version bits via the UUID constructor.
+_NS_URL_BYTES = uuid.NAMESPACE_URL.bytes
+
+def _chunk_id(source_id: str, i: int) -> str:
+    digest = hashlib.sha1(_NS_URL_BYTES + f"{source_id}:{i}".encode()).digest()[:16]
+    return str(uuid.UUID(bytes=digest, version=5))
+
+
 # --- Function 1: Ingest TEXT  ---
 @inngest_client.create_function(
     fn_id="RAG: Ingest Text",
@@ -42,35 +167,80 @@ inngest_client = inngest.Inngest(
 async def rag_ingest_text(ctx: inngest.Context):
     
     
-    def _chunk_text(text: str, chunk_size=1000, overlap=100):
+    def _chunk_text(text: str):
         if not text:
             return []
-        return [text[i:i+chunk_size] for i in range(0, len(text), chunk_size - overlap)]
+        # Same sentence-aware splitter as the PDF path: single-pass,
+        # clean boundaries, no duplicated overlap bytes through the embed API.
+        return splitter.split_text(text)
 
-    def _process_text(ctx: inngest.Context) -> RAGUpsertResult:
+    async def _process_text(ctx: inngest.Context) -> RAGUpsertResult:
         raw_text = ctx.event.data["text"]
         filename = ctx.event.data["filename"]
-        
+
         print(f"📄 Processing text from '{filename}' ({len(raw_text)} chars)...")
 
         chunks = _chunk_text(raw_text)
-        
+
         if not chunks:
             print(f"⚠️ No text content found for {filename}")
             return RAGUpsertResult(inngested=0)
 
-        # Create vectors
-        vecs = embed_texts(chunks)
-        
-        # Create deterministic IDs
-        ids = [str(uuid.uuid5(uuid.NAMESPACE_URL, f"{filename}:{i}")) for i in range(len(chunks))]
-        payloads = [{"source": filename, "text": chunk} for chunk in chunks]
-        
-        # Save to Qdrant
-        QdrantStorage().upsert(ids, vecs, payloads)
-        print(f"✅ Indexed {len(chunks)} chunks for {filename}")
-        
-        return RAGUpsertResult(inngested=len(chunks))
+        # Deterministic IDs + content hashes, built in a single pass over chunks;
+        # unchanged chunks are skipped below.
+        ids, hashes = map(list, zip(*(
+            (_chunk_id(filename, i), hashlib.blake2b(chunk.encode(), digest_size=16).hexdigest())
+            for i, chunk in enumerate(chunks)
+        )))
+
+        # Only the hash comes back — not every chunk's full text
+        existing = _qdrant.retrieve_payloads(ids, fields=["text_hash"])
+        new_idx = [
+            i for i in range(len(chunks))
+            if existing.get(ids[i], {}).get("text_hash") != hashes[i]
+        ]
+
+        if not new_idx:
+            print(f"♻️ All {len(chunks)} chunks for {filename} already indexed, skipping")
+            return RAGUpsertResult(inngested=0)
+
+        # Pipeline embed and upsert: each embedded batch is stored while the
+        # next one is still embedding, so total time is max(embed, upsert)
+        # rather than their sum.
+        UPSERT_BATCH = 32
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def _embed_batch(batch):
+            vecs = await aembed_texts([chunks[i] for i in batch])
+            await queue.put((batch, vecs))
+
+        async def _embed_producer():
+            # All batches fan out at once (bounded by data_loader's embed
+            # semaphore) and enqueue as they complete, instead of awaiting
+            # one batch at a time with a single request in flight. The
+            # sentinel goes out even when a batch raises, so the consumer
+            # always drains and exits instead of hanging on queue.get().
+            try:
+                await asyncio.gather(*(
+                    _embed_batch(new_idx[start:start + UPSERT_BATCH])
+                    for start in range(0, len(new_idx), UPSERT_BATCH)
+                ))
+            finally:
+                await queue.put(None)
+
+        async def _upsert_consumer():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                batch, vecs = item
+                payloads = [{"source": filename, "text": chunks[i], "text_hash": hashes[i]} for i in batch]
+                await _qdrant.aupsert([ids[i] for i in batch], vecs, payloads)
+
+        await asyncio.gather(_embed_producer(), _upsert_consumer())
+        print(f"✅ Indexed {len(new_idx)}/{len(chunks)} chunks for {filename}")
+
+        return RAGUpsertResult(inngested=len(new_idx))
 
    
     result = await ctx.step.run("chunk-embed-upsert", lambda: _process_text(ctx), output_type=RAGUpsertResult)
@@ -84,12 +254,26 @@ async def rag_ingest_text(ctx: inngest.Context):
 )
 async def rag_query_pdf(ctx: inngest.Context):
     
-    def _search(question: str, top_k: int = 5):
-        query_vec = embed_texts([question])[0]
-        store = QdrantStorage()
-        found = store.search(query_vec, top_k)
+    async def _embed_and_search(question: str, top_k: int = 5) -> RAGSearchResult:
+        # One step for embed + cache check + search: the 768-float query
+        # vector never crosses an Inngest step boundary, it stays in
+        # _pending_query_vecs for the cache write after generation.
+        query_vec = await Settings.embed_model.aget_query_embedding(question)
+
+        cached = query_cache.get(query_vec)
+        if cached is not None:
+            print(f"⚡ Semantic cache hit for: {question!r}")
+            return RAGSearchResult(
+                contexts=[],
+                sources=cached.sources,
+                cached_answer=cached.answer,
+                cached_num_contexts=cached.num_contexts,
+            )
+
+        _park_query_vec(_exact_cache_key(question), query_vec)
+        found = (await _qdrant.asearch([query_vec], top_k))[0]
         return RAGSearchResult(contexts=found["contexts"], sources=found["sources"])
-    
+
     async def _generate_answer(prompt: str):
         response = await Settings.llm.acomplete(prompt)
         return str(response)
@@ -97,28 +281,92 @@ async def rag_query_pdf(ctx: inngest.Context):
     question = ctx.event.data["question"]
     top_k = int(ctx.event.data.get("top_k", 5))
 
-    found = await ctx.step.run("embed-and-search", lambda: _search(question, top_k), output_type=RAGSearchResult)
+    # Identical question asked before? No embed, no search, no LLM.
+    exact_key = _exact_cache_key(question)
+    exact_hit = _exact_cache.get(exact_key)
+    if exact_hit is not None:
+        _exact_cache.move_to_end(exact_key)
+        print(f"⚡ Exact cache hit for: {question!r}")
+        # A replay that parked its vector before this answer landed in the
+        # exact cache ends here; drop the vector rather than strand it.
+        _pending_query_vecs.pop(exact_key, None)
+        output = exact_hit.model_dump()
+        _publish_answer(ctx.event.id, output)
+        return output
+
+    found = await ctx.step.run("embed-and-search", lambda: _embed_and_search(question, top_k), output_type=RAGSearchResult)
+
+    # Near-duplicate question already answered? Skip the LLM entirely.
+    if found.cached_answer is not None:
+        _pending_query_vecs.pop(exact_key, None)
+        output = RAGQueryResult(
+            answer=found.cached_answer,
+            sources=found.sources,
+            num_contexts=found.cached_num_contexts,
+        ).model_dump()
+        _publish_answer(ctx.event.id, output)
+        return output
 
-    context_block = "\n\n".join(f"- {c}" for c in found.contexts)
-    user_content = (
-        "Use the following context to answer the question.\n\n"
-        f"Context:\n{context_block}\n\n"
-        f"Question: {question}\n"
-        "Answer concisely using the context above."
-    )
+    # Build the prompt with a single join instead of nested joins/f-string
+    # concatenation — one allocation even for top_k=20 with long chunks.
+    parts = ["Use the following context to answer the question.\n\nContext:\n"]
+    parts.extend(f"- {c}\n\n" for c in found.contexts)
+    parts.append(f"Question: {question}\nAnswer concisely using the context above.")
+    user_content = "".join(parts)
 
-    answer_text = await ctx.step.run("llm-generate", lambda: _generate_answer(user_content))
+    try:
+        answer_text = await ctx.step.run("llm-generate", lambda: _generate_answer(user_content))
+    except Exception:
+        # Don't leak the held vector when generation fails for good.
+        # (Exception, not BaseException: the SDK's step interrupts must
+        # pass through untouched.)
+        _pending_query_vecs.pop(exact_key, None)
+        raise
     answer_text = answer_text.strip()
 
-    return {"answer": answer_text, "sources": found.sources, "num_contexts": len(found.contexts)}
+    result = RAGQueryResult(answer=answer_text, sources=found.sources, num_contexts=len(found.contexts))
+    query_vec = _pending_query_vecs.pop(exact_key, None)
+    if query_vec is not None:
+        query_cache.put(query_vec, result)
+    _exact_cache_put(exact_key, result)
+    output = result.model_dump()
+    _publish_answer(ctx.event.id, output)
+    return output
 
 
 app = FastAPI()
 
+@app.on_event("startup")
+async def warmup():
+    """Pay the cold-start cost (embed client, Qdrant metadata, LLM) at boot."""
+    try:
+        await Settings.embed_model.aget_text_embedding("warmup")
+        _qdrant.client.get_collections()
+        await Settings.llm.acomplete("ping")
+        print("🔥 Warmup complete")
+    except Exception as e:
+        print(f"⚠️ Warmup failed (continuing): {e}")
+
 @app.get("/")
 def read_root():
     return {"status": "alive", "message": "RAG Backend is running correctly"}
 
+@app.get("/answer/{event_id}")
+async def get_answer(event_id: str):
+    """Long-poll for a query answer: one request instead of a client poll loop."""
+    event = _answer_events.setdefault(event_id, asyncio.Event())
+    try:
+        await asyncio.wait_for(event.wait(), timeout=30)
+    except asyncio.TimeoutError:
+        # Don't keep events around for ids that may never publish
+        if not event.is_set():
+            _answer_events.pop(event_id, None)
+        return {"status": "pending"}
+    # Single consumer: deliver once and evict
+    output = _answers.pop(event_id, None)
+    _answer_events.pop(event_id, None)
+    return {"status": "done", "output": output}
+
 inngest.fast_api.serve(
     app, 
     inngest_client, 
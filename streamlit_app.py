@@ -1,4 +1,8 @@
 import asyncio
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from pathlib import Path
 import time
 import os
@@ -6,7 +10,10 @@ import os
 import streamlit as st
 import inngest
 from dotenv import load_dotenv
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pypdf import PdfReader
 
 load_dotenv()
@@ -25,6 +32,7 @@ else:
     inngest_url = "http://127.0.0.1:8288/v1"
     is_prod = False
 
+@st.cache_resource
 def get_inngest_client() -> inngest.Inngest:
     return inngest.Inngest(
         app_id="rag_app",
@@ -32,6 +40,19 @@ def get_inngest_client() -> inngest.Inngest:
         event_key=inngest_key,
     )
 
+# One persistent event loop on a daemon thread: asyncio.run per call would
+# build and tear down a fresh loop (and the Inngest client's HTTP connector)
+# every time. cache_resource keeps it alive across Streamlit reruns.
+@st.cache_resource
+def _get_loop() -> asyncio.AbstractEventLoop:
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+def run_async(coro):
+    """Run a coroutine on the shared loop; safe to call from any thread."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
 # --- ASYNC EVENT SENDERS ---
 
 async def send_rag_ingest_text_event(filename: str, text: str) -> None:
@@ -68,6 +89,44 @@ async def send_rag_query_event(question: str, top_k: int) -> str:
 def _inngest_api_base() -> str:
     return inngest_url
 
+BACKEND_URL = os.getenv("RAG_BACKEND_URL", "http://127.0.0.1:8000")
+
+# Shared session: keep-alive + TLS session reuse instead of a fresh
+# handshake on every poll, with transport-level retries so a transient
+# 5xx/429 doesn't crash the whole render mid-poll. cache_resource so the
+# pool survives Streamlit reruns instead of being rebuilt each script run.
+@st.cache_resource
+def _get_session() -> requests.Session:
+    retry = Retry(
+        total=5,
+        backoff_factor=0.2,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",),
+    )
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry))
+    session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry))
+    return session
+
+def _long_poll_answer(event_id: str) -> dict | None:
+    """One long-poll against the backend's /answer endpoint.
+
+    Returns the output if the answer arrived within the window, else None —
+    including when the run failed and will never publish — so the caller
+    falls back to the run API, which can tell Failed from still-running.
+    """
+    url = f"{BACKEND_URL}/answer/{event_id}"
+    try:
+        resp = _get_session().get(url, timeout=40)
+        resp.raise_for_status()
+    except requests.RequestException:
+        return None  # backend not reachable, fall back to run polling
+    data = resp.json()
+    if data.get("status") == "done":
+        return data.get("output") or {}
+    return None
+
+@st.cache_data(ttl=0.5, show_spinner=False)
 def fetch_runs(event_id: str) -> list[dict]:
     base_url = _inngest_api_base()
     url = f"{base_url}/events/{event_id}/runs"
@@ -80,31 +139,121 @@ def fetch_runs(event_id: str) -> list[dict]:
         else:
             st.error("Missing INNGEST_SIGNING_KEY in secrets!")
 
-    resp = requests.get(url, headers=headers)
+    resp = _get_session().get(url, headers=headers, timeout=5)
     resp.raise_for_status()
     data = resp.json()
     return data.get("data", [])
 
-def wait_for_run_output(event_id: str, timeout_s: float = 120.0, poll_interval_s: float = 1.0) -> dict:
+async def wait_for_run_output_async(event_id: str, timeout_s: float = 120.0) -> dict:
+    """Wait for the answer by blocking server-side (long-poll) instead of
+    burning HTTP round-trips. Falls back to run-API polling if the backend is
+    unreachable or hasn't published within the window — failed runs never
+    publish, and only the run API can report Failed/Cancelled."""
+    url = f"{BACKEND_URL}/answer/{event_id}"
+    try:
+        async with httpx.AsyncClient(timeout=40) as client:
+            resp = await client.get(url)
+            resp.raise_for_status()
+            data = resp.json()
+            if data.get("status") == "done":
+                return data.get("output") or {}
+    except httpx.HTTPError:
+        pass
+    return await asyncio.to_thread(_poll_run_output, event_id, timeout_s)
+
+def wait_for_run_output(event_id: str, timeout_s: float = 120.0) -> dict:
+    # Prefer the backend's long-poll endpoint: one held request instead of
+    # dozens of fixed-interval round-trips to the run API. Anything short of
+    # a delivered answer falls through to the run API, which also surfaces
+    # Failed/Cancelled runs instead of hanging until the deadline.
+    output = _long_poll_answer(event_id)
+    if output is not None:
+        return output
+    return _poll_run_output(event_id, timeout_s)
+
+def _poll_run_output(event_id: str, timeout_s: float = 120.0) -> dict:
     start = time.time()
     last_status = None
+    # Exponential backoff: fast runs return in ~100ms instead of a full
+    # fixed 1s bucket; slow runs converge to a 2s poll interval.
+    delay = 0.1
     while True:
         runs = fetch_runs(event_id)
         if runs:
             run = runs[0]
             status = run.get("status")
             last_status = status or last_status
-            
+
             if status in ("Completed", "Succeeded", "Success", "Finished"):
                 return run.get("output") or {}
-            
+
             if status in ("Failed", "Cancelled"):
                 raise RuntimeError(f"Function run {status}")
-        
+
         if time.time() - start > timeout_s:
             raise TimeoutError(f"Timed out waiting for run output (last status: {last_status})")
-        
-        time.sleep(poll_interval_s)
+
+        time.sleep(delay)
+        delay = min(delay * 1.5, 2.0)
+
+# Extracted text cached on disk by content hash, so re-uploads (even under
+# a different filename or after the browser session is lost) skip PdfReader.
+TEXT_CACHE_DIR = Path.home() / ".cache" / "rag-doc-qa"
+
+# Single worker so a 30s parse doesn't freeze the render thread; reruns poll
+# the future instead of blocking on script completion. cache_resource keeps
+# the same executor (and its queued work) alive across those reruns.
+@st.cache_resource
+def _get_extract_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=1)
+
+def extract_pdf_text(raw: bytes) -> str:
+    """Extract text from PDF bytes using the backend chosen by PDF_BACKEND.
+
+    Defaults to pypdfium2 (native PDFium core, typically 5-10x faster than
+    pypdf); falls back to pypdf if the import fails.
+    """
+    if os.getenv("PDF_BACKEND", "pypdfium2") == "pypdfium2":
+        try:
+            import pypdfium2 as pdfium
+        except ImportError:
+            pass
+        else:
+            doc = pdfium.PdfDocument(raw)
+            try:
+                return "\n".join(page.get_textpage().get_text_range() for page in doc)
+            finally:
+                doc.close()
+
+    # pypdf path: BytesIO keeps the many small seeks/reads in memory, and
+    # the pages join once instead of O(N^2) string concatenation.
+    # Extraction stays sequential: pypdf is pure Python (GIL-bound) and a
+    # shared reader is not thread-safe, so threads only add corruption.
+    reader = PdfReader(BytesIO(raw))
+    return "\n".join(page.extract_text() or "" for page in reader.pages)
+
+def _extract_and_send(raw: bytes, filename: str, digest: str) -> str:
+    """Extract text (disk cache first) and send the ingest event.
+
+    Runs in a background thread; returns the extracted text, or "" when the
+    PDF had no extractable text and no event was sent.
+    """
+    cache_path = TEXT_CACHE_DIR / f"{digest}.txt"
+    if cache_path.exists():
+        text_content = cache_path.read_text(encoding="utf-8")
+    else:
+        text_content = extract_pdf_text(raw)
+
+        TEXT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(text_content, encoding="utf-8")
+
+    # Skip the event entirely when there is nothing to ingest
+    # (e.g. a scanned image-only PDF)
+    if not text_content.strip():
+        return ""
+
+    run_async(send_rag_ingest_text_event(filename, text_content))
+    return text_content
 
 # --- UI LAYOUT ---
 
@@ -112,30 +261,40 @@ st.title("Upload a PDF to Ingest")
 uploaded = st.file_uploader("Choose a PDF", type=["pdf"], accept_multiple_files=False)
 
 if uploaded is not None:
-    # Unique ID to prevent re-processing on every redraw
-    file_id = f"processed_{uploaded.name}_{uploaded.size}"
+    # Read the bytes once: the hash and the parser both work off this buffer
+    raw = uploaded.getvalue()
+
+    # Key by content hash, so identical bytes under any name dedupe
+    digest = hashlib.sha1(raw).hexdigest()
+    file_id = f"processed_{digest}"
 
     if file_id not in st.session_state:
-        with st.spinner("Extracting text and triggering ingestion..."):
-            
-            # 1. Extract Text Locally
+        # Kick extraction off in the background and poll its future across
+        # reruns, so the UI stays responsive during long parses.
+        future_key = f"extract_future_{digest}"
+        if future_key not in st.session_state:
+            st.session_state[future_key] = _get_extract_pool().submit(
+                _extract_and_send, raw, uploaded.name, digest
+            )
+
+        future = st.session_state[future_key]
+        if future.done():
+            st.session_state.pop(future_key, None)
             try:
-                reader = PdfReader(uploaded)
-                text_content = ""
-                for page in reader.pages:
-                    text_content += page.extract_text() + "\n"
-                
-                # 2. Send Event
-                # asyncio.run is required because  calling async from sync context
-                asyncio.run(send_rag_ingest_text_event(uploaded.name, text_content))
-                
-                # 3. Mark as done
-                st.session_state[file_id] = True
-                st.success(f"Successfully extracted {len(text_content)} characters and sent to backend!")
-                
+                text_content = future.result()
             except Exception as e:
                 st.error(f"Error reading PDF: {e}")
-            
+            else:
+                st.session_state[file_id] = True
+                if text_content:
+                    st.success(f"Successfully extracted {len(text_content)} characters and sent to backend!")
+                else:
+                    st.warning("No extractable text (image-only PDF?). Skipping ingestion.")
+        else:
+            st.info("Extracting text and triggering ingestion...")
+            time.sleep(0.5)
+            st.rerun()
+
     else:
         st.info(f"Already processed: {uploaded.name}")
 
@@ -150,8 +309,8 @@ with st.form("rag_query_form"):
     if submitted and question.strip():
         with st.spinner("Sending event and generating answer..."):
             try:
-                event_id = asyncio.run(send_rag_query_event(question.strip(), int(top_k)))
-                output = wait_for_run_output(event_id)
+                event_id = run_async(send_rag_query_event(question.strip(), int(top_k)))
+                output = run_async(wait_for_run_output_async(event_id))
                 answer = output.get("answer", "")
                 sources = output.get("sources", [])
 
@@ -1,54 +1,212 @@
-from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams, Distance, PointStruct
+import asyncio
+import numpy as np
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.models import (
+    VectorParams,
+    Distance,
+    Datatype,
+    Batch,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+    QuantizationSearchParams,
+    HnswConfigDiff,
+    QueryRequest,
+    PayloadSelectorInclude,
+)
+
+# Only the fields _collect reads: anything else in the payload (e.g.
+# text_hash) never leaves the server.
+_PAYLOAD_FIELDS = PayloadSelectorInclude(include=["text", "source"])
 import os
 from dotenv import load_dotenv
 
 
 
+# Keep the gRPC connection alive between ingest bursts so repeated calls
+# skip the TCP/TLS handshake.
+_GRPC_OPTIONS = {
+    "grpc.keepalive_time_ms": 30_000,
+    "grpc.keepalive_permit_without_calls": 1,
+}
+
+
 class QdrantStorage:
-    def __init__(self, collection="docs", dim=768):
+    def __init__(self, collection="docs", dim=768, hnsw_m=24, hnsw_ef_construct=128):
         # 1. Load URL and Key from Environment Variables
         # If running on Render, it uses the "Secret" variables.
         # If running locally, it defaults back to your localhost.
-        qdrant_url = os.getenv("QDRANT_URL", "http://localhost:6333")
-        qdrant_key = os.getenv("QDRANT_API_KEY", None)
+        self.qdrant_url = os.getenv("QDRANT_URL", "http://localhost:6333")
+        self.qdrant_key = os.getenv("QDRANT_API_KEY", None)
+
+        self.grpc_port = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+
+        # 2. Initialize the client (api_key is required for Cloud, ignored for local).
+        # gRPC ships vectors as packed float32 over one persistent connection
+        # instead of REST's per-call JSON.
+        self.client = QdrantClient(
+            url=self.qdrant_url,
+            api_key=self.qdrant_key,
+            timeout=30,
+            prefer_grpc=True,
+            grpc_port=self.grpc_port,
+            grpc_options=_GRPC_OPTIONS,
+        )
 
-        # 2. Initialize the client (api_key is required for Cloud, ignored for local)
-        self.client = QdrantClient(url=qdrant_url, api_key=qdrant_key, timeout=30)
-        
         self.collection = collection
+        self._async_client = None
         
         # 3. Create collection if missing
         if not self.client.collection_exists(self.collection):
             self.client.create_collection(
                 collection_name=self.collection,
-                vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
+                # Raw float16 vectors live on disk; only the int8-quantized
+                # copies stay in RAM (4x smaller, faster to dot-product).
+                # Searches rescore against the raw vectors below.
+                vectors_config=VectorParams(
+                    size=dim, distance=Distance.COSINE, datatype=Datatype.FLOAT16, on_disk=True
+                ),
+                quantization_config=ScalarQuantization(
+                    scalar=ScalarQuantizationConfig(type=ScalarType.INT8, always_ram=True, quantile=0.99)
+                ),
+                # Graph knobs sized for the 100k-1M vector range; defaults
+                # (m=16, ef_construct=100) leave recall/QPS on the table.
+                hnsw_config=HnswConfigDiff(
+                    m=hnsw_m, ef_construct=hnsw_ef_construct, full_scan_threshold=10000
+                ),
             )
     
-    def upsert(self, ids, vectors, payloads):
-        points = [PointStruct(id=ids[i], vector=vectors[i], payload=payloads[i]) for i in range(len(ids))]
-        self.client.upsert(self.collection, points=points)
+    def upsert(self, ids, vectors, payloads, batch_size=256):
+        # Send in batches: one giant request risks the 30s client timeout,
+        # and wait=False lets later batches pipeline while the server
+        # indexes earlier ones. The final batch waits, as a fence.
+        for start in range(0, len(ids), batch_size):
+            end = min(start + batch_size, len(ids))
+            self.client.upsert(
+                self.collection,
+                points=Batch(
+                    ids=list(ids[start:end]),
+                    vectors=self._vecs_list(vectors[start:end]),
+                    payloads=list(payloads[start:end]),
+                ),
+                wait=(end == len(ids)),
+            )
+
+    @staticmethod
+    def _vecs_list(vecs):
+        # Vector contract: contiguous float32. The gRPC path packs ndarrays
+        # as raw float32 without ever boxing them into Python lists.
+        if isinstance(vecs, np.ndarray):
+            return np.ascontiguousarray(vecs, dtype=np.float32)
+        return [
+            np.ascontiguousarray(v, dtype=np.float32) if isinstance(v, np.ndarray) else v
+            for v in vecs
+        ]
+
+    @staticmethod
+    def _query_vec(vec):
+        if isinstance(vec, np.ndarray):
+            return np.ascontiguousarray(vec, dtype=np.float32)
+        return vec
+
+    @property
+    def async_client(self) -> AsyncQdrantClient:
+        # Lazy: gRPC channel is only opened if the async path is used
+        if self._async_client is None:
+            self._async_client = AsyncQdrantClient(
+                url=self.qdrant_url,
+                api_key=self.qdrant_key,
+                prefer_grpc=True,
+                timeout=30,
+                grpc_port=self.grpc_port,
+                grpc_options=_GRPC_OPTIONS,
+            )
+        return self._async_client
+
+    async def aupsert(self, ids, vectors, payloads):
+        await self.async_client.upsert(
+            self.collection,
+            points=Batch(ids=list(ids), vectors=self._vecs_list(vectors), payloads=list(payloads)),
+        )
+
+    def retrieve_payloads(self, ids, fields=None):
+        """Fetch payloads (no vectors) for the given point ids, as {id: payload}.
+
+        Pass fields to pull only those payload keys instead of everything.
+        """
+        points = self.client.retrieve(
+            collection_name=self.collection,
+            ids=ids,
+            with_payload=PayloadSelectorInclude(include=list(fields)) if fields else True,
+            with_vectors=False,
+        )
+        return {str(p.id): (p.payload or {}) for p in points}
+
+    @staticmethod
+    def _search_params(ef: int | None) -> SearchParams:
+        # hnsw_ef trades latency for recall per query; None keeps the
+        # collection default.
+        return SearchParams(
+            hnsw_ef=ef,
+            quantization=QuantizationSearchParams(rescore=True, oversampling=2.0),
+        )
+
+    def search(self, query_vector, top_k: int = 5, ef: int | None = 128):
 
-    def search(self, query_vector, top_k: int = 5):
-        
         result = self.client.query_points(
             collection_name=self.collection,
-            query=query_vector,
-            limit=top_k
+            query=self._query_vec(query_vector),
+            limit=top_k,
+            with_payload=_PAYLOAD_FIELDS,
+            search_params=self._search_params(ef),
         )
-        
-        # Access the list of points from the result
-        results = result.points
 
+        return self._collect(result.points)
+
+    async def asearch(self, query_vectors, top_k: int = 5, ef: int | None = 128):
+        """Search one or more query vectors concurrently over a single gRPC channel."""
+        results = await asyncio.gather(*(
+            self.async_client.query_points(
+                collection_name=self.collection,
+                query=self._query_vec(v),
+                limit=top_k,
+                with_payload=_PAYLOAD_FIELDS,
+                search_params=self._search_params(ef),
+            )
+            for v in query_vectors
+        ))
+        return [self._collect(r.points) for r in results]
+
+    def search_batch(self, query_vectors, top_k: int = 5, ef: int | None = 128):
+        """Submit several searches as one server-side batch (single round trip)."""
+        requests = [
+            QueryRequest(
+                # QueryRequest is a strict REST model, so unbox ndarrays here
+                query=v.tolist() if isinstance(v, np.ndarray) else v,
+                limit=top_k,
+                params=self._search_params(ef),
+                with_payload=_PAYLOAD_FIELDS,
+            )
+            for v in query_vectors
+        ]
+        responses = self.client.query_batch_points(self.collection, requests=requests)
+        return [self._collect(r.points) for r in responses]
+
+    def _collect(self, results):
         contexts = []
-        sources = set()
+        # dict keys preserve insertion order, so sources come back in
+        # relevance order instead of arbitrary set order
+        sources_seen = {}
 
         for r in results:
-            payload = getattr(r, "payload", None) or {}
-            text = payload.get("text", "")
-            source = payload.get("source", "")
-            if text:
-                contexts.append(text)
-                sources.add(source)
-
-        return {"contexts": contexts, "sources": list(sources)}
+            payload = r.payload or {}
+            text = payload.get("text")
+            if not text:
+                continue
+            contexts.append(text)
+            source = payload.get("source")
+            if source:
+                sources_seen.setdefault(source, None)
+
+        return {"contexts": contexts, "sources": list(sources_seen)}